@@ -0,0 +1,454 @@
+"""
+Texture atlas for Tour OF Samurai
+
+Build step:  python atlas.py            (all levels)
+             python atlas.py 2 3        (only some levels)
+
+Packs every image a level uses (tiles from all of its tilesets, the
+samurai, the wolf and the dagger) into one or a few atlas pages, with
+identical images stored only once. For each level it writes to maps/atlas/:
+
+    level_N_0.png ...     the atlas pages
+    level_N.json          UV table: source image -> page, x, y, width, height,
+                          plus the source files the atlas was built from
+    map_level_N.tmx       copy of the map whose tiles point into the atlas
+
+At runtime the game calls use_level() and loads textures through
+load_texture() / level_map_file(), which fall back to the original files
+when no up to date atlas exists for the level.
+"""
+import hashlib
+import json
+import os
+import sys
+import time
+import xml.etree.ElementTree as ElementTree
+
+import arcade
+from PIL import Image
+
+# Where the atlas files are written
+ATLAS_DIRECTORY = "maps/atlas"
+
+# Largest atlas page, a size every GL driver can take
+ATLAS_MAX_SIZE = 2048
+
+# Empty pixels between images so filtering never bleeds into a neighbour
+ATLAS_PADDING = 1
+
+# Tiled keeps the flip flags in the top bits of a gid
+GID_MASK = 0x1FFFFFFF
+
+# Images used in code rather than in the maps
+SPRITE_IMAGE_FOLDERS = ["assets/Samurai", "assets/wolf", "assets/dagger"]
+
+# UV table of the active level, None when the original files are used
+atlas_table = None
+
+# Level the UV table was last checked for, so restarts skip the check
+atlas_level = None
+
+
+def atlas_path(file_name):
+    """Path of a file inside the atlas directory."""
+    return os.path.join(ATLAS_DIRECTORY, file_name)
+
+
+def normalise_path(path):
+    """Key used for an image in the UV table."""
+    return os.path.normpath(path).replace(os.sep, "/")
+
+
+def hash_files(paths):
+    """Hash the map, tileset and image files so a stale atlas can be detected."""
+    digest = hashlib.sha1()
+    for path in sorted(normalise_path(path) for path in paths):
+        digest.update(path.encode())
+        if os.path.exists(path):
+            with open(path, "rb") as file:
+                digest.update(file.read())
+    return digest.hexdigest()
+
+
+# -- Build step
+
+
+def read_map(map_name):
+    """
+    Read a map and all of its tilesets.
+    Returns the map tree, the tilesets as (element, directory, source file)
+    and the map and tileset files it refers to.
+    """
+    map_tree = ElementTree.parse(map_name)
+    map_directory = os.path.dirname(map_name)
+    tilesets = []
+    source_files = [normalise_path(map_name)]
+
+    for tileset in map_tree.getroot().findall("tileset"):
+        source = tileset.get("source")
+        if source is None:
+            tilesets.append((tileset, map_directory, None))
+            continue
+
+        # Missing tilesets are listed too, so the atlas goes stale once they turn up
+        tileset_file = os.path.join(map_directory, source)
+        source_files.append(normalise_path(tileset_file))
+        if not os.path.exists(tileset_file):
+            print(f"Warning, can't find tileset {tileset_file}, leaving it as is.")
+            tilesets.append((tileset, map_directory, None))
+            continue
+
+        external = ElementTree.parse(tileset_file).getroot()
+        tilesets.append((external, os.path.dirname(tileset_file), tileset_file))
+
+    return map_tree, tilesets, source_files
+
+
+def used_tile_ids(map_tree):
+    """
+    Find the tiles the map places, as a set of tile ids for each tileset.
+    Returns None when the map stores layer data in a way we can't read.
+    """
+    root = map_tree.getroot()
+    gids = set()
+    for data in root.iter("data"):
+        if data.get("encoding") != "csv":
+            return None
+        gids.update(int(gid) & GID_MASK for gid in data.text.replace("\n", "").split(",") if gid)
+    for map_object in root.iter("object"):
+        if map_object.get("gid") is not None:
+            gids.add(int(map_object.get("gid")) & GID_MASK)
+
+    first_gids = [int(tileset.get("firstgid")) for tileset in root.findall("tileset")]
+    used = [set() for _ in first_gids]
+    for gid in gids:
+        # Each gid belongs to the last tileset that starts at or before it
+        for index in range(len(first_gids) - 1, -1, -1):
+            if gid >= first_gids[index] > 0:
+                used[index].add(gid - first_gids[index])
+                break
+    return used
+
+
+def collect_images(tilesets, used_tiles):
+    """List every image file used by the tiles the map places and the sprites."""
+    images = []
+    for index, (tileset, directory, _) in enumerate(tilesets):
+        for tile in tileset.findall("tile"):
+            tile_id = int(tile.get("id"))
+            if used_tiles is not None and tile_id not in used_tiles[index]:
+                continue
+            # Animated tiles need the images of every frame
+            frames = [tile] + [
+                tileset.find(f"tile[@id='{frame.get('tileid')}']")
+                for frame in tile.iter("frame")
+            ]
+            for frame_tile in frames:
+                image = frame_tile.find("image") if frame_tile is not None else None
+                if image is None:
+                    continue
+                path = normalise_path(os.path.join(directory, image.get("source")))
+                if os.path.exists(path):
+                    images.append(path)
+
+    for folder in SPRITE_IMAGE_FOLDERS:
+        for file_name in sorted(os.listdir(folder)):
+            if file_name.endswith(".png"):
+                images.append(normalise_path(os.path.join(folder, file_name)))
+
+    # Keep the order but drop repeats
+    return list(dict.fromkeys(images))
+
+
+def pack_images(sizes, shelf_width=ATLAS_MAX_SIZE):
+    """
+    Shelf pack images into pages of at most shelf_width by ATLAS_MAX_SIZE.
+    sizes is a dict of key -> (width, height).
+    Returns key -> (page, x, y) and the size of each page.
+    """
+    placements = {}
+    pages = []
+
+    # Tallest first keeps the shelves tight
+    order = sorted(sizes, key=lambda key: (-sizes[key][1], -sizes[key][0]))
+
+    page_width = page_height = 0
+    shelf_x = shelf_y = shelf_height = 0
+    for key in order:
+        width, height = sizes[key]
+        width += ATLAS_PADDING
+        height += ATLAS_PADDING
+        if width > shelf_width or height > ATLAS_MAX_SIZE:
+            raise ValueError(f"{key} is too big for a {shelf_width} wide atlas page")
+
+        # Start a new shelf
+        if shelf_x + width > shelf_width:
+            shelf_x = 0
+            shelf_y += shelf_height
+            shelf_height = 0
+
+        # Start a new page
+        if not pages or shelf_y + height > ATLAS_MAX_SIZE:
+            if pages:
+                pages[-1] = (page_width, page_height)
+            pages.append((0, 0))
+            page_width = page_height = 0
+            shelf_x = shelf_y = shelf_height = 0
+
+        placements[key] = (len(pages) - 1, shelf_x, shelf_y)
+        shelf_x += width
+        shelf_height = max(shelf_height, height)
+        page_width = max(page_width, shelf_x)
+        page_height = max(page_height, shelf_y + shelf_height)
+
+    if pages:
+        pages[-1] = (page_width, page_height)
+
+    return placements, pages
+
+
+def pack_tightest(sizes):
+    """Try a range of shelf widths and keep the packing with the least area."""
+    widest = max(width for width, _ in sizes.values()) + ATLAS_PADDING
+    best = None
+    for shelf_width in range(widest, ATLAS_MAX_SIZE + 1, 32):
+        placements, pages = pack_images(sizes, shelf_width)
+        area = sum(width * height for width, height in pages)
+        if best is None or (len(pages), area) < best[0]:
+            best = ((len(pages), area), placements, pages)
+    return best[1], best[2]
+
+
+def rewrite_map(map_tree, tilesets, uv_table, page_files):
+    """Point every tile of the map at its place in the atlas."""
+    root = map_tree.getroot()
+    map_tilesets = root.findall("tileset")
+
+    for map_tileset, (tileset, directory, source) in zip(map_tilesets, tilesets):
+        if source is None and map_tileset.get("source") is not None:
+            # Tileset we could not read, keep the reference working
+            map_tileset.set(
+                "source", rebase_path(os.path.join(directory, map_tileset.get("source")))
+            )
+            continue
+
+        for tile in tileset.findall("tile"):
+            image = tile.find("image")
+            if image is None:
+                continue
+            path = normalise_path(os.path.join(directory, image.get("source")))
+            if path not in uv_table:
+                image.set("source", rebase_path(path))
+                continue
+
+            page, x, y, width, height = uv_table[path]
+            page_width, page_height = page_files[page][1]
+            image.set("source", os.path.basename(page_files[page][0]))
+            image.set("width", str(page_width))
+            image.set("height", str(page_height))
+            tile.set("x", str(x))
+            tile.set("y", str(y))
+            tile.set("width", str(width))
+            tile.set("height", str(height))
+
+        if source is not None:
+            # Inline the external tileset so the map has no other files
+            inline = ElementTree.Element("tileset", {"firstgid": map_tileset.get("firstgid")})
+            for name, value in tileset.attrib.items():
+                if name not in ("version", "tiledversion"):
+                    inline.set(name, value)
+            inline.extend(list(tileset))
+            index = list(root).index(map_tileset)
+            root.remove(map_tileset)
+            root.insert(index, inline)
+
+
+def rebase_path(path):
+    """Path relative to the atlas directory."""
+    return os.path.relpath(path, ATLAS_DIRECTORY).replace(os.sep, "/")
+
+
+def build_level(level):
+    """Build the atlas, UV table and atlas map for one level."""
+    map_name = f"maps/map_level_{level}.tmx"
+    map_tree, tilesets, source_files = read_map(map_name)
+    images = collect_images(tilesets, used_tile_ids(map_tree))
+
+    # Load each image once and drop exact duplicates
+    unique = {}
+    duplicate_of = {}
+    for path in images:
+        image = Image.open(path).convert("RGBA")
+        key = hashlib.sha1(
+            repr(image.size).encode() + image.tobytes()
+        ).hexdigest()
+        if key not in unique:
+            unique[key] = image
+        duplicate_of[path] = key
+
+    sizes = {key: image.size for key, image in unique.items()}
+    placements, pages = pack_tightest(sizes)
+
+    # Draw the pages
+    page_files = []
+    for index, page_size in enumerate(pages):
+        page_files.append((atlas_path(f"level_{level}_{index}.png"), page_size))
+    page_images = [Image.new("RGBA", size, (0, 0, 0, 0)) for size in pages]
+    for key, (page, x, y) in placements.items():
+        page_images[page].paste(unique[key], (x, y))
+    os.makedirs(ATLAS_DIRECTORY, exist_ok=True)
+    for page_image, (page_file, _) in zip(page_images, page_files):
+        page_image.save(page_file, optimize=True)
+
+    # UV table for every source image, duplicates share a rectangle
+    uv_table = {}
+    for path, key in duplicate_of.items():
+        page, x, y = placements[key]
+        width, height = sizes[key]
+        uv_table[path] = [page, x, y, width, height]
+
+    rewrite_map(map_tree, tilesets, uv_table, page_files)
+    map_tree.write(atlas_path(f"map_level_{level}.tmx"), encoding="UTF-8", xml_declaration=True)
+
+    used_area = sum(width * height for width, height in sizes.values())
+    page_area = sum(width * height for width, height in pages)
+    stats = {
+        "images": len(images),
+        "unique_images": len(unique),
+        "pages": len(pages),
+        "fill_ratio": round(used_area / page_area, 3) if page_area else 0,
+    }
+    # Everything the atlas was built from, checked again at runtime
+    source_files = source_files + images
+    table = {
+        "source_files": source_files,
+        "source_hash": hash_files(source_files),
+        "pages": [os.path.basename(page_file) for page_file, _ in page_files],
+        "textures": uv_table,
+        "stats": stats,
+    }
+    with open(atlas_path(f"level_{level}.json"), "w") as file:
+        json.dump(table, file, sort_keys=True)
+
+    return table
+
+
+def time_level_load(level, use_atlas):
+    """Time what setup() does to load a level: use_level() and load_tilemap()."""
+    global atlas_table, atlas_level
+
+    arcade.cleanup_texture_cache()
+    atlas_table = atlas_level = None
+    start = time.perf_counter()
+    if use_atlas:
+        use_level(level)
+    arcade.load_tilemap(level_map_file(level))
+    return time.perf_counter() - start
+
+
+def time_texture_decode(table, use_atlas):
+    """Time loading every texture in the UV table, without the map."""
+    global atlas_table
+
+    arcade.cleanup_texture_cache()
+    atlas_table = table if use_atlas else None
+    start = time.perf_counter()
+    for path in table["textures"]:
+        load_texture(path)
+    return time.perf_counter() - start
+
+
+def benchmark_level(level, table):
+    """Report level load and texture decode time, from the files and from the atlas."""
+    global atlas_table, atlas_level
+
+    try:
+        separate_time = time_level_load(level, False)
+        atlas_time = time_level_load(level, True)
+        print(
+            f"  level load {separate_time * 1000:.1f} ms separate "
+            f"vs {atlas_time * 1000:.1f} ms atlas"
+        )
+    except (OSError, ValueError) as error:
+        print(f"  level load not timed, the map does not load: {error}")
+
+    separate_time = time_texture_decode(table, False)
+    atlas_time = time_texture_decode(table, True)
+    print(
+        f"  texture decode only {separate_time * 1000:.1f} ms separate "
+        f"vs {atlas_time * 1000:.1f} ms atlas"
+    )
+
+    arcade.cleanup_texture_cache()
+    atlas_table = atlas_level = None
+
+
+def build(levels):
+    """Build every level and report how well the atlases pack."""
+    for level in levels:
+        table = build_level(level)
+        stats = table["stats"]
+        print(
+            f"Level {level}: {stats['images']} images, {stats['unique_images']} unique, "
+            f"{stats['pages']} page(s), fill {stats['fill_ratio']:.0%}"
+        )
+        benchmark_level(level, table)
+
+
+# -- Runtime loader
+
+
+def use_level(level):
+    """
+    Load the UV table for a level.
+    Returns False and falls back to the original files when the atlas is
+    missing or older than the map it was built from.
+    """
+    global atlas_table, atlas_level
+    if level == atlas_level:
+        return atlas_table is not None
+    atlas_table = None
+    atlas_level = level
+
+    table_file = atlas_path(f"level_{level}.json")
+    if not os.path.exists(table_file):
+        return False
+    with open(table_file) as file:
+        table = json.load(file)
+
+    if table["source_hash"] != hash_files(table["source_files"]):
+        print(f"Warning, texture atlas for level {level} is out of date, run atlas.py.")
+        return False
+
+    atlas_table = table
+    return True
+
+
+def level_map_file(level):
+    """Map file to load for a level."""
+    if atlas_table is not None:
+        return atlas_path(f"map_level_{level}.tmx")
+    return f"./maps/map_level_{level}.tmx"
+
+
+def load_texture(filename, flipped_horizontally=False):
+    """Load a texture from the atlas, or from its own file without one."""
+    path = normalise_path(filename)
+    if atlas_table is None or path not in atlas_table["textures"]:
+        return arcade.load_texture(filename, flipped_horizontally=flipped_horizontally)
+
+    page, x, y, width, height = atlas_table["textures"][path]
+    return arcade.load_texture(
+        atlas_path(atlas_table["pages"][page]),
+        x,
+        y,
+        width,
+        height,
+        flipped_horizontally=flipped_horizontally,
+    )
+
+
+if __name__ == "__main__":
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    build_levels = [int(level) for level in sys.argv[1:]] or [1, 2, 3]
+    build(build_levels)
@@ -0,0 +1,229 @@
+"""
+Memory diagnostics for Tour OF Samurai
+
+    python main.py --diagnostics      count live objects after every setup()
+    python main.py --soak 1000        die 1000 times, then report
+    python diagnostics.py             check the counting while a sound plays
+
+After each setup() the live sprites, sprite lists, textures, sound players
+and GL objects are counted, grouped by owner. A count that grows across
+GROWTH_RESETS resets in a row is flagged. The soak walks the player into an
+enemy every frame and at the end compares the counts over the last
+SOAK_WINDOW resets with the same window halfway through, once sounds and
+caches have warmed up.
+"""
+import gc
+import os
+import sys
+import weakref
+
+import arcade
+import pyglet
+from pyglet import media
+from pyglet.media.drivers.silent.adaptation import SilentDriver
+
+# Flag a count that has grown across this many resets in a row
+GROWTH_RESETS = 10
+
+# Allowed growth of the python object count over the second half of a soak
+PYTHON_OBJECT_TOLERANCE = 0.01
+
+# Number of resets whose counts are compared at the end of a soak
+SOAK_WINDOW = 50
+
+# Is diagnostics mode on
+enabled = False
+
+# Deaths to die in the soak, 0 when not soaking
+soak_deaths = 0
+
+# Has the soak reported, so it only reports once
+soak_finished = False
+
+# One dict of (kind, owner) -> count per setup()
+snapshots = []
+
+# Counts already flagged, so each is only reported once per streak
+flagged = set()
+
+# Sound file each player was started for
+player_owners = weakref.WeakKeyDictionary()
+
+
+def configure(args):
+    """Turn on diagnostics from the command line arguments."""
+    global enabled, soak_deaths
+    if "--diagnostics" in args:
+        enabled = True
+    if "--soak" in args:
+        index = args.index("--soak")
+        # Default to 1000 deaths when no number follows
+        if index + 1 < len(args) and args[index + 1].isdigit():
+            soak_deaths = int(args[index + 1])
+        else:
+            soak_deaths = 1000
+        enabled = True
+
+
+def play_sound(sound):
+    """Play a sound and remember which sound the player belongs to."""
+    player = arcade.play_sound(sound)
+    if player is None:
+        return None
+    player_owners[player] = os.path.basename(sound.file_name)
+
+    # The silent audio driver, used without a sound card, never ends a sound,
+    # so end it after its length or every player would look like a leak
+    if enabled and isinstance(media.get_audio_driver(), SilentDriver):
+        pyglet.clock.schedule_once(
+            lambda delta_time: player.dispatch_event("on_eos"), sound.get_length()
+        )
+    return player
+
+
+def sprite_list_owner(sprite_list, scene):
+    """Name of the scene layer that holds a sprite list."""
+    if scene is not None:
+        for name, layer in scene.name_mapping.items():
+            if layer is sprite_list:
+                return name
+    return "not in scene"
+
+
+def count_live_objects(scene=None):
+    """Count live objects of each kind, grouped by owner."""
+    gc.collect()
+    cached_textures = {id(texture) for texture in arcade.load_texture.texture_cache.values()}
+
+    counts = {}
+
+    def add(kind, owner):
+        counts[(kind, owner)] = counts.get((kind, owner), 0) + 1
+
+    for item in gc.get_objects():
+        if isinstance(item, arcade.Sprite):
+            add("sprites", type(item).__name__)
+        elif isinstance(item, arcade.SpriteList):
+            add("sprite lists", sprite_list_owner(item, scene))
+        elif isinstance(item, arcade.Texture):
+            add("textures", "cached" if id(item) in cached_textures else "not cached")
+        elif isinstance(item, media.Player) and type(item) is not weakref.ProxyType:
+            # Audio drivers hold a weak proxy to their player, skip it
+            add("sound players", player_owners.get(item, "unknown"))
+
+    # GL objects are counted by the context as created and freed
+    window = arcade.get_window()
+    stats = window.ctx.stats
+    for name in ("buffer", "texture", "framebuffer", "vertex_array", "geometry", "program"):
+        created, freed = getattr(stats, name)
+        counts[("gl objects", name)] = created - freed
+
+    counts[("python", "objects")] = len(gc.get_objects())
+    return counts
+
+
+def snapshot(scene):
+    """Take a snapshot after setup() and flag counts that keep growing."""
+    global soak_finished
+    if not enabled or soak_finished:
+        return
+
+    snapshots.append(count_live_objects(scene))
+    report_growth()
+
+    # The first snapshot is the start of the game, the rest are deaths
+    if soak_deaths and len(snapshots) > soak_deaths:
+        report_soak()
+        soak_finished = True
+        # Closing the window also ends the headless event loop
+        arcade.close_window()
+
+
+def report_growth():
+    """Print counts that have grown across the last GROWTH_RESETS resets."""
+    recent = snapshots[-(GROWTH_RESETS + 1):]
+    latest = snapshots[-1]
+    for key, count in latest.items():
+        history = [counts.get(key, 0) for counts in recent]
+        growing = len(recent) > GROWTH_RESETS and all(
+            before < after for before, after in zip(history, history[1:])
+        )
+        if growing and key not in flagged:
+            flagged.add(key)
+            print(
+                f"Warning, {key[0]} ({key[1]}) grew across {GROWTH_RESETS} resets: "
+                f"{history[0]} -> {count}"
+            )
+        elif not growing:
+            flagged.discard(key)
+
+
+def count_range(window):
+    """Lowest and highest count of each kind over a window of snapshots."""
+    keys = set().union(*window)
+    return {
+        key: (
+            min(counts.get(key, 0) for counts in window),
+            max(counts.get(key, 0) for counts in window),
+        )
+        for key in keys
+    }
+
+
+def report_soak():
+    """
+    Print the soak result, comparing the last resets with the ones halfway.
+    A count leaks when its lowest value at the end is above its highest value
+    halfway, so sounds that happen to be playing at a snapshot don't count.
+    """
+    size = max(1, min(SOAK_WINDOW, len(snapshots) // 2))
+    middle = len(snapshots) // 2
+    halfway = count_range(snapshots[middle - size + 1:middle + 1])
+    latest = count_range(snapshots[-size:])
+
+    print(f"Soak finished, {soak_deaths} deaths, counts (lowest-highest) over {size} resets")
+    leaks = []
+    for key in sorted(set(halfway) | set(latest)):
+        before_low, before_high = halfway.get(key, (0, 0))
+        after_low, after_high = latest.get(key, (0, 0))
+        print(
+            f"  {key[0]:14} {key[1]:20} {before_low:8}-{before_high:<8} -> "
+            f"{after_low:8}-{after_high:<8}"
+        )
+        if key == ("python", "objects"):
+            after_low = after_low / (1 + PYTHON_OBJECT_TOLERANCE)
+        if after_low > before_high:
+            leaks.append(key)
+
+    if leaks:
+        print("Memory did not stay flat: " + ", ".join(f"{kind} ({owner})" for kind, owner in leaks))
+    else:
+        print("Memory stayed flat")
+
+
+def soak_step(scene, player_sprite):
+    """Put the player on an enemy so the next collision check kills them."""
+    # The headless loop never runs pyglet's clock or events, so sounds
+    # would never reach their end and free their players
+    if arcade.get_window().headless:
+        pyglet.clock.tick()
+        pyglet.app.platform_event_loop.dispatch_posted_events()
+
+    enemies = scene["Enemies"]
+    if len(enemies) > 0:
+        player_sprite.center_x = enemies[0].center_x
+        player_sprite.center_y = enemies[0].center_y
+        return True
+    return False
+
+
+if __name__ == "__main__":
+    # Count live objects while a sound is playing, each player only once
+    arcade.Window(100, 100, "Diagnostics check")
+    enabled = True
+    play_sound(arcade.load_sound(":resources:sounds/hit5.wav"))
+    sound_players = count_live_objects()[("sound players", "hit5.wav")]
+    arcade.close_window()
+    if sound_players != 1:
+        sys.exit(f"Counted {sound_players} sound players for one sound")
+    print("Diagnostics check passed")
@@ -7,8 +7,12 @@ import math
 import os
 
 import arcade
+import sys
 import time
 
+import atlas
+import diagnostics
+
 # screen resolution
 SCREEN_WIDTH = 1000
 SCREEN_HEIGHT = 600
@@ -63,8 +67,8 @@ def load_texture_pair(filename):
     Load a texture pair, with the second being a mirror image.
     """
     return [
-        arcade.load_texture(filename),
-        arcade.load_texture(filename, flipped_horizontally=True),
+        atlas.load_texture(filename),
+        atlas.load_texture(filename, flipped_horizontally=True),
     ]
 
 
@@ -93,9 +97,9 @@ class Entity(arcade.Sprite):
 
         # Textures for climbing
         self.climbing_textures = []
-        texture = arcade.load_texture(f"{main_path}_climb0.png")
+        texture = atlas.load_texture(f"{main_path}_climb0.png")
         self.climbing_textures.append(texture)
-        texture = arcade.load_texture(f"{main_path}_climb1.png")
+        texture = atlas.load_texture(f"{main_path}_climb1.png")
         self.climbing_textures.append(texture)
 
         # Initial texture
@@ -269,13 +273,17 @@ class MyGame(arcade.Window):
 
     def setup(self):
         """Set up the game here. Call this function to restart the game."""
+        global sound_played
 
         # Setup the Cameras
         self.camera = arcade.Camera(self.width, self.height)
         self.gui_camera = arcade.Camera(self.width, self.height)
 
+        # Use the level's texture atlas when it has been built
+        atlas.use_level(self.level)
+
         # Map name
-        map_name = f"./maps/map_level_{self.level}.tmx"
+        map_name = atlas.level_map_file(self.level)
 
         # Layer Specific 
         layer_options = {
@@ -311,7 +319,8 @@ class MyGame(arcade.Window):
 
         #Play background music
         if sound_played == False:
-            arcade.play_sound(self.game_sound)        
+            diagnostics.play_sound(self.game_sound)
+            sound_played = True
 
         # Set up the player, 
         self.player_sprite = PlayerCharacter()
@@ -364,6 +373,9 @@ class MyGame(arcade.Window):
             walls=self.scene[LAYER_NAME_PLATFORMS]
         )
 
+        # Count live objects when diagnostics are on
+        diagnostics.snapshot(self.scene)
+
     def on_draw(self):
         """Render the screen."""
 
@@ -403,7 +415,7 @@ class MyGame(arcade.Window):
             ):
                 self.player_sprite.change_y = PLAYER_JUMP_SPEED
                 self.jump_needs_reset = True
-                arcade.play_sound(self.jump_sound)
+                diagnostics.play_sound(self.jump_sound)
         elif self.down_pressed and not self.up_pressed:
             if self.physics_engine.is_on_ladder():
                 self.player_sprite.change_y = -PLAYER_MOVEMENT_SPEED
@@ -492,10 +504,10 @@ class MyGame(arcade.Window):
 
         if self.can_shoot:
             if self.shoot_pressed:
-                arcade.play_sound(self.shoot_sound)
+                diagnostics.play_sound(self.shoot_sound)
                 bullet = arcade.Sprite(
-                    "assets/dagger/dagger.png",
-                    SPRITE_SCALING_LASER,
+                    scale=SPRITE_SCALING_LASER,
+                    texture=atlas.load_texture("assets/dagger/dagger.png"),
                 )
 
                 if self.player_sprite.facing_direction == RIGHT_FACING:
@@ -573,7 +585,7 @@ class MyGame(arcade.Window):
                             self.score += 100
 
                         # Hiting sound
-                        arcade.play_sound(self.hit_sound)
+                        diagnostics.play_sound(self.hit_sound)
 
                 return
 
@@ -583,6 +595,12 @@ class MyGame(arcade.Window):
             ):
                 bullet.remove_from_sprite_lists()
 
+        # Diagnostics soak, walk into an enemy to die again
+        if diagnostics.soak_deaths:
+            if not diagnostics.soak_step(self.scene, self.player_sprite):
+                self.setup()
+                return
+
         player_collision_list = arcade.check_for_collision_with_lists(
             self.player_sprite,
             [
@@ -595,7 +613,7 @@ class MyGame(arcade.Window):
         for collision in player_collision_list:
 
             if self.scene[LAYER_NAME_ENEMIES] in collision.sprite_lists:
-                arcade.play_sound(self.game_over)
+                diagnostics.play_sound(self.game_over)
                 self.setup()
                 return
             else:
@@ -608,13 +626,13 @@ class MyGame(arcade.Window):
 
                 # Remove the coin
                 collision.remove_from_sprite_lists()
-                arcade.play_sound(self.collect_coin_sound)
+                diagnostics.play_sound(self.collect_coin_sound)
 
         # Did the player fall off the map?
 
         if self.player_sprite.center_y < -100:
 
-            arcade.play_sound(self.game_over)
+            diagnostics.play_sound(self.game_over)
             
             time.sleep(1)
 
@@ -637,7 +655,7 @@ class MyGame(arcade.Window):
             self.player_sprite, self.scene[LAYER_NAME_DONT_TOUCH]
 
         ):
-            arcade.play_sound(self.game_over)
+            diagnostics.play_sound(self.game_over)
 
             sound_played = True
 
@@ -670,6 +688,7 @@ class MyGame(arcade.Window):
 
 def main():
     """Main function"""
+    diagnostics.configure(sys.argv[1:])
     window = MyGame()
     window.setup()
     arcade.run()